@@ -18,11 +18,17 @@ Notes:
 """
 
 from datetime import datetime, timezone, timedelta
+import numpy as np
 import pandas as pd
-import requests
+import requests_cache
 from tabulate import tabulate
 
 
+# Responses are cached on disk (opsweb_cache.sqlite) for an hour, keyed by URL and parameters, 
+# and the session keeps the connection alive between requests:
+session = requests_cache.CachedSession('opsweb_cache', expire_after=3600)
+
+
 def opsw_request(start_time, end_time, mission, event_type):
     """Fetch event data from ESA OPSWeb API."""
 
@@ -33,7 +39,7 @@ def opsw_request(start_time, end_time, mission, event_type):
     # (the line was removed for publication)
     params = {'time_start': time_start, 'time_end': time_end}
 
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.status_code != 200:
         print("OPSWeb request failed:", response.status_code, response.reason)
         return []
@@ -47,6 +53,46 @@ def opsw_request(start_time, end_time, mission, event_type):
     return data
 
 
+def parse_utc(times):
+    """
+    Parse ISO 8601 UTC timestamps (optional 'Z' suffix) with NumPy's built-in datetime64 parser.
+    Missing values become NaT; timestamps with explicit offsets (e.g. '+00:00') are parsed by pandas.
+    """
+    times = [t.rstrip('Z') if t else 'NaT' for t in times]
+    if any('+' in t or '-' in t[10:] for t in times):
+        return pd.to_datetime(times, format='ISO8601', utc=True).tz_convert(None).values.astype('datetime64[ns]')
+    return np.array(times, dtype='datetime64[ns]')
+
+
+def format_utc(df, columns):
+    """Format datetime columns in place as 'YYYY-MM-DD HH:MM:SS' strings (UTC)."""
+    for col in columns:
+        values = df[col].values.astype('datetime64[s]')
+        iso = values.astype('U19')
+        formatted = np.char.replace(iso, 'T', ' ') if len(iso) else iso
+        df[col] = np.where(np.isnat(values), 'NaT', formatted)  # keep missing values readable
+
+
+def covered_by_pass(req_start, req_end, pass_start, pass_end):
+    """
+    Checks for every requested window [req_start, req_end] whether it lies entirely within a single pass.
+
+    Containment is a 2D dominance query on the points (start, -end): a pass covers [a, b] if 
+    start <= a and -end <= -b. Passes are sorted by start time and a running maximum of their 
+    end times is built, so that one binary search per window finds the latest-ending pass among 
+    those starting early enough. Runs vectorized over all windows at once.
+    """
+    if len(pass_start) == 0:
+        return np.zeros(len(req_start), dtype=bool)
+
+    order = np.argsort(pass_start, kind='stable')
+    start_sorted = pass_start[order]
+    end_maxprefix = np.maximum.accumulate(pass_end[order])
+
+    idx = np.searchsorted(start_sorted, req_start, side='right')
+    return (idx > 0) & (end_maxprefix[np.maximum(idx - 1, 0)] >= req_end)
+
+
 # ------------------------ Configuration ------------------------
 
 start_date_str = "1.1.2020"
@@ -62,70 +108,86 @@ mission_name = 'tgo'
 
 event_type = 'passes'
 passes = opsw_request(StartTime, EndTime, mission_name, event_type)
-df_passes = pd.DataFrame(passes).sort_values(by=['time_end', 'time_start']).reset_index(drop=True)
 
 # Filter out excluded groundstations and MSPA passes:
-df_passes = df_passes[~df_passes['groundstation'].isin(['KLZ', 'BLK'])]
-df_passes = df_passes[df_passes['mspa'] != 'true']
+passes = [p for p in passes if p['groundstation'] not in ('KLZ', 'BLK') and p.get('mspa') != 'true']
+
+time_start = parse_utc([p['time_start'] for p in passes])
+time_end   = parse_utc([p['time_end']   for p in passes])
+
+# Sort by end time, then start time:
+order      = np.lexsort((time_start, time_end))
+passes     = [passes[i] for i in order]
+time_start = time_start[order]
+time_end   = time_end[order]
 
 # Apply OWLT (One-Way Light Time) correction:
-df_passes['time_start']      = pd.to_datetime(df_passes['time_start'], utc=True, format='ISO8601')
-df_passes['time_end']        = pd.to_datetime(df_passes['time_end'],   utc=True, format='ISO8601')
-df_passes['owlt_delta']      = pd.to_timedelta('00:' + df_passes['owlt'])
-df_passes['time_start_corr'] = df_passes['time_start'] - df_passes['owlt_delta']
-df_passes['time_end_corr']   = df_passes['time_end']   - df_passes['owlt_delta']
+owlt_parts = (np.array([p['owlt'].split(':') for p in passes], dtype=np.float64).reshape(len(passes), -1)
+              if passes else np.empty((0, 2)))  # [HH:]MM:SS.sss
+owlt_sec   = owlt_parts @ 60.0 ** np.arange(owlt_parts.shape[1])[::-1]
+owlt_delta = np.round(owlt_sec * 1e9).astype(np.int64).view('timedelta64[ns]')
+ts_corr    = time_start - owlt_delta
+te_corr    = time_end   - owlt_delta
+
+# DataFrame is only kept for the output table:
+df_passes = pd.DataFrame(passes)
+df_passes['time_start']      = time_start
+df_passes['time_end']        = time_end
+df_passes['owlt_delta']      = owlt_delta
+df_passes['time_start_corr'] = ts_corr
+df_passes['time_end_corr']   = te_corr
 
 
 # ------------------------ Retrieve Occultations ------------------------
 
 event_type = 'occultations'
 occultations = opsw_request(StartTime, EndTime, mission_name, event_type)
-df_occ = pd.DataFrame(occultations).sort_values(by=['time_end', 'time_start']).reset_index(drop=True)
+occ_start = parse_utc([o['time_start'] for o in occultations])
+occ_end   = parse_utc([o['time_end']   for o in occultations])
 
-df_occ['time_start'] = pd.to_datetime(df_occ['time_start'], utc=True)
-df_occ['time_end']   = pd.to_datetime(df_occ['time_end'],   utc=True)
+# Sort by end time, then start time:
+order     = np.lexsort((occ_start, occ_end))
+occ_start = occ_start[order]
+occ_end   = occ_end[order]
 
+df_occ = pd.DataFrame(occultations).iloc[order].reset_index(drop=True)
+df_occ['time_start'] = pd.DatetimeIndex(occ_start, tz='UTC')
+df_occ['time_end']   = pd.DatetimeIndex(occ_end,   tz='UTC')
 
-# ------------------------ Check for Coverage ------------------------
-
-covered = []
-for _, occ_row in df_occ.iterrows():
-    ing_time = occ_row['time_start']
-    egr_time = occ_row['time_end']
 
-    # Define ±10 minute windows around ingress and egress:
-    ing_start_req = ing_time - timedelta(minutes=10)
-    ing_end_req   = ing_time
-    egr_start_req = egr_time
-    egr_end_req   = egr_time + timedelta(minutes=10)
-
-    mask_ing = (
-        (df_passes['time_start_corr'] <= ing_start_req) &
-        (df_passes['time_end_corr']   >= ing_end_req)
-    )
-    mask_egr = (
-        (df_passes['time_start_corr'] <= egr_start_req) &
-        (df_passes['time_end_corr']   >= egr_end_req)
-    )
+# ------------------------ Check for Coverage ------------------------
 
-    # Only include occultation if both ingress and egress are covered:
-    if mask_ing.any() and mask_egr.any():
-        covered.append({
-            'ingress': ing_time,
-            'egress':  egr_time
-        })
+# Timestamps as int64 nanoseconds, so that all comparisons run on native integers:
+ing_time = occ_start.view('i8')
+egr_time = occ_end.view('i8')
+
+# Passes and occultations with missing times (NaT) never count as covering or covered:
+pass_ok  = ~(np.isnat(ts_corr) | np.isnat(te_corr))
+occ_ok   = ~(np.isnat(occ_start) | np.isnat(occ_end))
+ts_valid = ts_corr[pass_ok].view('i8')
+te_valid = te_corr[pass_ok].view('i8')
+
+# Define ±10 minute windows around ingress and egress:
+margin   = np.timedelta64(10, 'm').astype('timedelta64[ns]').view('i8')
+mask_ing = covered_by_pass(ing_time - margin, ing_time, ts_valid, te_valid)
+mask_egr = covered_by_pass(egr_time, egr_time + margin, ts_valid, te_valid)
+
+# Only include occultation if both ingress and egress are covered:
+df_covered = (
+    df_occ.loc[occ_ok & mask_ing & mask_egr, ['time_start', 'time_end']]
+    .rename(columns={'time_start': 'ingress', 'time_end': 'egress'})
+    .reset_index(drop=True)
+)
 
-df_covered = pd.DataFrame(covered)
+# Machine-readable copy for covered_occultations.py (the text files are for humans):
+df_covered.to_parquet("opsweb_covered.parquet", index=False)
 
 
 # ------------------------ Format Output ------------------------
 
-fmt = '%Y-%m-%d %H:%M:%S'
-df_passes[['time_start', 'time_end', 'time_start_corr', 'time_end_corr']] = (
-    df_passes[['time_start', 'time_end', 'time_start_corr', 'time_end_corr']].apply(lambda col: col.dt.strftime(fmt))
-)
-df_occ[['time_start', 'time_end']] = df_occ[['time_start', 'time_end']].apply(lambda col: col.dt.strftime(fmt))
-df_covered[['ingress', 'egress']] = df_covered[['ingress', 'egress']].apply(lambda col: col.dt.strftime(fmt))
+format_utc(df_passes,  ['time_start', 'time_end', 'time_start_corr', 'time_end_corr'])
+format_utc(df_occ,     ['time_start', 'time_end'])
+format_utc(df_covered, ['ingress', 'egress'])
 
 print("Valid passes:\n", df_passes)
 print("Covered occultations:\n", df_covered)
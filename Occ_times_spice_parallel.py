@@ -5,12 +5,16 @@ Date: 02.07.2025
 Description:
     Computes occultation events (ingress and egress) for ExoMars TGO using SPICE,
     identifying when the impact parameter crosses the Mars radius.
+    Events are located with the SPICE Geometry Finder (gfoclt); the brute-force sweep over
+    the impact parameter is kept as a reference implementation.
+    SPICE calls are vectorized over ET arrays using the SpiceyPy Cyice wrappers and the sweep
+    is split into monthly chunks distributed over multiple CPU cores to reduce runtime and memory.
     Results include UTC time, latitude, longitude, solar zenith angle (SZA) and solar longitude (Ls).
-    Computation is parallelized using multiple CPU cores to reduce runtime.
 """
 
 import numpy as np
 import spiceypy as spice
+import spiceypy.cyice as cyice
 import pandas as pd
 import time
 from concurrent.futures import ProcessPoolExecutor
@@ -50,28 +54,78 @@ load_kernels()
 T0_UTC = '2020-01-01T00:00:00.000'
 T1_UTC = '2024-12-31T23:59:59.000'
 STEP = 1  # seconds
+GF_STEP = 60  # seconds, must be shorter than the shortest occultation and visibility period
+MAXWIN = 100000  # maximum number of occultation windows returned by gfoclt
+SWEEP_CHUNK = 30 * 86400  # seconds, length of the ET chunks processed per task by the sweep
 start_et = spice.str2et(T0_UTC)
 end_et = spice.str2et(T1_UTC)
 
 
-def init_spice():
-    load_kernels()
-
-
-def compute_tangent_params(et, gs_id):
+def compute_tangent_params(et_list, gs_id):
     """
-    Computation of impact parameters and tangent points.
+    Computation of impact parameters and tangent points for an array of ETs.
+    Returns a boolean mask flagging the epochs for which the tangent point could be computed.
     """
+    n = len(et_list)
+    valid = np.ones(n, dtype=bool)
     try:
-        ray = spice.spkpos(gs_id, et, sv.frame, 'CN+S', sv.tgo_hga_id)[0]
-        tanpt, *_ = spice.tangpt('ELLIPSOID', 'MARS', et, sv.frame, 'CN+S',
-                                 'TANGENT POINT', sv.tgo_hga_id, sv.frame, ray)
-        ip = np.linalg.norm(tanpt)
-        sun_vec = spice.spkpos('SUN', et, sv.frame, 'NONE', sv.mars_id)[0]
-        sza = np.rad2deg(spice.vsep(sun_vec, tanpt))
-        return et, ip, tanpt, sza
+        rays, _ = cyice.spkpos(gs_id, et_list, sv.frame, 'CN+S', sv.tgo_hga_id)
     except spice.stypes.SpiceyError:
-        return None
+        # Ephemeris gap within the array: fall back to per-epoch calls and flag the failing epochs
+        rays = np.full((n, 3), np.nan)
+        for i in range(n):
+            try:
+                rays[i] = cyice.spkpos(gs_id, float(et_list[i]), sv.frame, 'CN+S', sv.tgo_hga_id)[0]
+            except spice.stypes.SpiceyError:
+                valid[i] = False
+
+    # tangpt takes a single ray direction, so it is looped over the precomputed rays:
+    tanpts = np.full((n, 3), np.nan)
+    for i in np.flatnonzero(valid):
+        try:
+            tanpts[i] = cyice.tangpt('ELLIPSOID', 'MARS', float(et_list[i]), sv.frame, 'CN+S',
+                                     'TANGENT POINT', sv.tgo_hga_id, sv.frame, rays[i])[0]
+        except spice.stypes.SpiceyError:
+            valid[i] = False
+
+    impact_params = np.sqrt(np.einsum('ij,ij->i', tanpts, tanpts))
+    return impact_params, tanpts, valid
+
+
+
+def find_crossings(impact_params, radius):
+    """
+    Returns the indices of the first samples below (ingress) and above (egress) the radius
+    after each crossing, using a single comparison pass over the impact parameters.
+    """
+    above = impact_params > radius
+    change = np.flatnonzero(above[:-1] != above[1:]) + 1
+    return change[~above[change]], change[above[change]]
+
+
+
+def sweep_chunk(bounds, gs_id, start_et, step):
+    """
+    Sweeps the samples first..last (inclusive) of the global ET grid and returns the ETs 
+    and tangent points of the ingress and egress samples found within, plus the 
+    (ET, impact parameter, tangent point) of the first and last valid sample (None if 
+    the chunk has no valid sample) for bridging crossings between chunks.
+    """
+    first, last = bounds
+    et_list = start_et + np.arange(first, last + 1) * step
+    impact_params, tanpts, valid = compute_tangent_params(et_list, gs_id)
+
+    # Crossings are searched on the valid epochs only:
+    valid_idx = np.flatnonzero(valid)
+    ing_idx, egr_idx = find_crossings(impact_params[valid_idx], MARS_RADIUS)
+    ing_idx = valid_idx[ing_idx]
+    egr_idx = valid_idx[egr_idx]
+
+    edges = None
+    if len(valid_idx):
+        edges = tuple((et_list[i], impact_params[i], tanpts[i]) for i in (valid_idx[0], valid_idx[-1]))
+
+    return et_list[ing_idx], tanpts[ing_idx], et_list[egr_idx], tanpts[egr_idx], edges
 
 
 
@@ -80,52 +134,157 @@ def find_occultations_parallel(gs_id, start_et, end_et, step, n_procs=4):
     Identifies TGO–Earth radio occultation events by detecting when the impact 
     parameter crosses the Mars mean radius.
 
+    The sweep is processed in chunks of SWEEP_CHUNK seconds, and only the crossing 
+    events of each chunk are kept, so memory does not scale with the full time range.
+
     For each ingress and egress, computes:
     - Time (ET and UTC)
     - Tangent point latitude and longitude
     - Solar Zenith Angle (SZA)
     """
-    et_list = np.arange(start_et, end_et, step)
-    worker = partial(compute_tangent_params, gs_id=gs_id)
+    n = int(np.ceil((end_et - start_et) / step))
+    chunk = max(int(SWEEP_CHUNK // step), 1)
+    worker = partial(sweep_chunk, gs_id=gs_id, start_et=start_et, step=step)
+
+    # Consecutive chunks share their boundary sample, so a crossing next to a valid boundary sample is 
+    # found within one chunk only. Crossings spanning invalid samples at a boundary are bridged below.
+    bounds = [(first, min(first + chunk, n - 1)) for first in range(0, n - 1, chunk)]
+
+    with ProcessPoolExecutor(max_workers=n_procs, initializer=load_kernels) as executor:
+        results = list(executor.map(worker, bounds))
+
+    ing_ets, ing_tanpts, egr_ets, egr_tanpts = [], [], [], []
+    last_valid = None
+    for ing_et, ing_tp, egr_et, egr_tp, edges in results:
+        if edges is None:
+            continue
+        first_valid = edges[0]
+        # Crossing between the last valid sample of the previous chunks and the first valid sample of this one:
+        if last_valid is not None and (last_valid[1] > MARS_RADIUS) != (first_valid[1] > MARS_RADIUS):
+            et_out, tp_out = (egr_ets, egr_tanpts) if first_valid[1] > MARS_RADIUS else (ing_ets, ing_tanpts)
+            et_out.append(np.array([first_valid[0]]))
+            tp_out.append(first_valid[2].reshape(1, 3))
+        ing_ets.append(ing_et)
+        ing_tanpts.append(ing_tp)
+        egr_ets.append(egr_et)
+        egr_tanpts.append(egr_tp)
+        last_valid = edges[1]
+
+    # The empty arrays keep the concatenation valid if no chunk has a valid sample:
+    ing_ets    = np.concatenate(ing_ets    + [np.empty(0)])
+    ing_tanpts = np.concatenate(ing_tanpts + [np.empty((0, 3))])
+    egr_ets    = np.concatenate(egr_ets    + [np.empty(0)])
+    egr_tanpts = np.concatenate(egr_tanpts + [np.empty((0, 3))])
+
+    df_ing = event_table(ing_ets, ing_tanpts, 'Ingress')
+    df_egr = event_table(egr_ets, egr_tanpts, 'Egress')
 
-    with ProcessPoolExecutor(max_workers=n_procs, initializer=init_spice) as executor:
-        results = list(executor.map(worker, et_list, chunksize=500))
+    return df_ing, df_egr
 
-    valid = [r for r in results if r]
-    et_vals, impact_params, tanpts, szas = zip(*valid)
 
-    et_vals = np.array(et_vals)
-    impact_params = np.array(impact_params)
-    tanpts = np.array(tanpts)
-    szas = np.array(szas)
 
-    ing_mask = (impact_params[:-1] > MARS_RADIUS) & (impact_params[1:] <= MARS_RADIUS)  # ingress
-    egr_mask = (impact_params[:-1] <= MARS_RADIUS) & (impact_params[1:] > MARS_RADIUS)  # egress
+def gf_search(gs_id, left, right, step):
+    """
+    Runs the SPICE GF occultation search (Earth behind the Mars ellipsoid as seen from the 
+    TGO HGA) over [left, right] and returns the occultation windows as an (N, 2) array.
+    """
+    cnfine = spice.cell_double(2)
+    spice.wninsd(left, right, cnfine)
+    result = spice.cell_double(2 * MAXWIN)
+    spice.gfoclt('ANY', sv.mars_id, 'ELLIPSOID', sv.frame, gs_id, 'POINT', ' ',
+                 'CN+S', sv.tgo_hga_id, step, cnfine, result)
+    return np.array([spice.wnfetd(result, i) for i in range(spice.wncard(result))]).reshape(-1, 2)
+
 
-    ingress, egress = [], []
-    for mask, out in [(ing_mask, ingress), (egr_mask, egress)]:
-        for idx in np.where(mask)[0] + 1:
-            t_et = et_vals[idx]
-            _, lon, lat = spice.reclat(tanpts[idx])
-            sza = szas[idx]
-            ls_deg = np.degrees(spice.lspcn('MARS', t_et, 'LT+S')) % 360  # Solar longitude in deg
-            out.append((t_et, np.degrees(lon), np.degrees(lat), sza, ls_deg))
 
-    df_ing = pd.DataFrame(ingress, columns=['ET', 'Longitude (deg)', 'Latitude (deg)', 'SZA (deg)', 'Ingress Ls (deg)'])
-    df_ing['Ingress UTC'] = spice.et2utc(df_ing['ET'].tolist(), 'ISOC', 3)
+def merge_touching(intervals):
+    """
+    Merges sorted intervals of an (N, 2) array where one ends exactly where the next starts.
+    """
+    merged = []
+    for left, right in intervals:
+        if merged and merged[-1][1] == left:
+            merged[-1][1] = right
+        else:
+            merged.append([left, right])
+    return np.array(merged).reshape(-1, 2)
+
+
+
+def find_occultations_gf(gs_id, start_et, end_et, step):
+    """
+    Identifies TGO–Earth radio occultation events with the SPICE Geometry Finder, 
+    which returns the occultation windows directly instead of sampling every epoch.
 
-    df_egr = pd.DataFrame(egress, columns=['ET', 'Longitude (deg)', 'Latitude (deg)', 'SZA (deg)', 'Egress Ls (deg)'])
-    df_egr['Egress UTC'] = spice.et2utc(df_egr['ET'].tolist(), 'ISOC', 3)
+    If the search fails (e.g. an SPK or CK coverage gap), it is repeated over sub-windows 
+    of SWEEP_CHUNK seconds and the failing ones are skipped. Windows truncated by the 
+    searched intervals are skipped. Tangent point geometry is only computed at the 
+    ingress and egress epochs.
+    """
+    try:
+        searched = [(start_et, end_et)]
+        windows = [gf_search(gs_id, start_et, end_et, step)]
+    except spice.stypes.SpiceyError:
+        searched, windows = [], []
+        for left in np.arange(start_et, end_et, SWEEP_CHUNK):
+            right = min(left + SWEEP_CHUNK, end_et)
+            try:
+                windows.append(gf_search(gs_id, left, right, step))
+                searched.append((left, right))
+            except spice.stypes.SpiceyError:
+                continue
+
+    # Occultations split at the boundary of two searched sub-windows are joined again:
+    searched = merge_touching(searched)
+    windows = merge_touching(np.concatenate(windows + [np.empty((0, 2))]))
+
+    k = np.searchsorted(searched[:, 0], windows[:, 0], side='right') - 1
+    complete = (windows[:, 0] > searched[k, 0]) & (windows[:, 1] < searched[k, 1])
+    windows = windows[complete]
+
+    event_ets = windows.ravel()
+    _, tanpts, valid = compute_tangent_params(event_ets, gs_id)
+    valid = valid.reshape(-1, 2).all(axis=1).repeat(2)
+
+    event_ets, tanpts = event_ets[valid], tanpts[valid]
+    df_ing = event_table(event_ets[0::2], tanpts[0::2], 'Ingress')
+    df_egr = event_table(event_ets[1::2], tanpts[1::2], 'Egress')
 
     return df_ing, df_egr
 
 
 
+def event_table(t_ets, tanpts, label):
+    """
+    Builds the ingress or egress table (ET, UTC, latitude, longitude, SZA and Ls) for the given events.
+    Latitude and longitude follow reclat, inlined in NumPy; Ls, UTC and the Sun direction for the SZA
+    use the vectorized Cyice calls.
+    """
+    t_ets = np.ascontiguousarray(t_ets, dtype=np.float64)
+    sun_vecs, _ = cyice.spkpos('SUN', t_ets, sv.frame, 'NONE', sv.mars_id)
+    cos_sza = np.einsum('ij,ij->i', sun_vecs, tanpts) / (np.linalg.norm(sun_vecs, axis=1) * np.linalg.norm(tanpts, axis=1))
+    szas = np.rad2deg(np.arccos(np.clip(cos_sza, -1.0, 1.0)))
+    lons = np.degrees(np.arctan2(tanpts[:, 1], tanpts[:, 0]))
+    lats = np.degrees(np.arctan2(tanpts[:, 2], np.hypot(tanpts[:, 0], tanpts[:, 1])))
+    ls_deg = np.degrees(cyice.lspcn('MARS', t_ets, 'LT+S')) % 360  # Solar longitude in deg
+
+    df = pd.DataFrame({
+        'ET': t_ets,
+        'Longitude (deg)': lons,
+        'Latitude (deg)': lats,
+        'SZA (deg)': szas,
+        f'{label} Ls (deg)': ls_deg,
+    })
+    df[f'{label} UTC'] = cyice.et2utc(t_ets, 'ISOC', 3)
+    return df
+
+
+
 if __name__ == '__main__':
     start_time = time.time()
 
-    df_ingress, df_egress = find_occultations_parallel(
-        sv.earth_id, start_et, end_et, STEP
+    df_ingress, df_egress = find_occultations_gf(
+        sv.earth_id, start_et, end_et, GF_STEP
     )
 
 
@@ -133,8 +292,8 @@ if __name__ == '__main__':
     ing = df_ingress[['Ingress UTC', 'Latitude (deg)', 'Longitude (deg)', 'SZA (deg)', 'Ingress Ls (deg)']].reset_index(drop=True)
     eg = df_egress[['Egress UTC', 'Latitude (deg)', 'Longitude (deg)', 'SZA (deg)', 'Egress Ls (deg)']].reset_index(drop=True)
 
-    ing.columns = ['Ingress UTC', 'Ingress Lat (deg)', 'Longitude (deg)', 'Ingress SZA (deg)', 'Ingress Ls (deg)']
-    eg.columns  = ['Egress UTC',  'Egress Lat (deg)', 'Longitude (deg)', 'Egress SZA (deg)', 'Egress Ls (deg)']
+    ing.columns = ['Ingress UTC', 'Ingress Lat (deg)', 'Ingress Lon (deg)', 'Ingress SZA (deg)', 'Ingress Ls (deg)']
+    eg.columns  = ['Egress UTC',  'Egress Lat (deg)', 'Egress Lon (deg)', 'Egress SZA (deg)', 'Egress Ls (deg)']
 
     df_wide = pd.concat([ing, eg], axis=1)
 
@@ -153,4 +312,10 @@ if __name__ == '__main__':
         f.write(f"Created on (UTC): {ts}\n\n")
         f.write(wide_txt + "\n")
 
+    # Machine-readable copy with datetime columns (the text file is for humans):
+    df_wide.assign(**{
+        'Ingress UTC': pd.to_datetime(df_wide['Ingress UTC']),
+        'Egress UTC':  pd.to_datetime(df_wide['Egress UTC']),
+    }).to_parquet("Occultations_spice.parquet", index=False)
+
 
@@ -11,54 +11,94 @@ ATTENTION:
     Basically all dates before 1.1.2023 have mspa = nan, thus they are skipped.
 '''
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-
-OBSWEB_FILE = 'opsweb_covered.txt'
-SPICE_FILE = 'Occultations_spice.txt'    
-
-df_obsweb = pd.read_csv(
-    OBSWEB_FILE,
-    skiprows=2,                   
-    sep=r"\s{2,}",               
-    engine="python",              
-    parse_dates=[                 # parse the date columns back to datetime64
-        "ingress",
-        "egress",
-    ],
-)
-
-df_spice = pd.read_csv(
-    SPICE_FILE,
-    skiprows=2,
-    sep=r"\s{2,}",
-    engine="python",
-    parse_dates=["Ingress UTC","Egress UTC"]
-)
-df_spice = df_spice[
-    (df_spice['Ingress UTC'] >= "2023-01-01") &
-    (df_spice['Ingress UTC'] <  "2025-01-01")
-]
+from matplotlib.lines import Line2D
+
+OBSWEB_FILE = 'opsweb_covered.parquet'
+SPICE_FILE = 'Occultations_spice.parquet'
+
+
+def nearest_match_mask(times, ref_times, tolerance_ns):
+    """
+    Flags every entry of `times` whose nearest entry in the sorted `ref_times` lies within 
+    `tolerance_ns`. Both arrays are int64 nanosecond timestamps.
+    """
+    if len(ref_times) == 0:
+        return np.zeros(len(times), dtype=bool)
+
+    idx = np.searchsorted(ref_times, times)
+    left = ref_times[np.clip(idx - 1, 0, len(ref_times) - 1)]
+    right = ref_times[np.clip(idx, 0, len(ref_times) - 1)]
+    nearest_diff = np.minimum(np.abs(times - left), np.abs(right - times))
+    return nearest_diff <= tolerance_ns
+
+
+def plot_latitudes(df, x_ing, x_egr, xlabel, title, xlim, legend_anchor, label_sep=' ', date_axis=False):
+    """
+    Plots ingress (blue) and egress (red) latitudes against the given columns in a single scatter call.
+    """
+    n_ingress = len(df[x_ing])
+    n_egress  = len(df[x_egr])
+    x = np.concatenate([df[x_ing].values, df[x_egr].values])
+    y = np.concatenate([df['Ingress Lat (deg)'].values, df['Egress Lat (deg)'].values])
+    colors = np.repeat(['blue', 'red'], [n_ingress, n_egress])
+
+    # Legend entries drawn by hand, since both point sets share one collection:
+    handles = [
+        Line2D([], [], linestyle='none', marker='o', markersize=np.sqrt(10), markerfacecolor='none',
+               markeredgecolor=color, label=f'{name} Points{label_sep}(N={n})')
+        for name, color, n in [('Ingress', 'blue', n_ingress), ('Egress', 'red', n_egress)]
+    ]
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.scatter(
+        x,
+        y,
+        facecolors='none',     # no fill
+        edgecolors=colors,     # circle outline color
+        s=10,                  # adjust marker size
+        linewidths=1,          # outline thickness
+    )
+    ax.set_xlabel(xlabel, size=13)
+    ax.set_ylabel('Mars latitude [deg]', size=13)
+    ax.set_title(title, size=15)
+    ax.grid(color="gray", linestyle="dotted", linewidth=0.5)
+    ax.legend(handles=handles, loc='upper right', bbox_to_anchor=legend_anchor)
+    if date_axis:
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))  # Set date formatter to show year-month-day
+        ax.xaxis.set_major_locator(mdates.MonthLocator(interval=2))  # interval=3 for 2020-2024, =2 for 2023-2024
+        fig.autofmt_xdate()  # auto-rotate date labels
+    ax.set_xlim(*xlim)
+    ax.set_ylim(-90, 90)
+    fig.tight_layout()
+    plt.show()
+
+
+df_obsweb = pd.read_parquet(OBSWEB_FILE)
+df_spice  = pd.read_parquet(SPICE_FILE)
+
+# Ingress times as int64 nanoseconds, shared by the date filter and the matching below:
+spice_ing = df_spice['Ingress UTC'].values.astype('datetime64[ns]').view('i8')
+lo        = np.datetime64('2023-01-01', 'ns').view('i8')
+hi        = np.datetime64('2025-01-01', 'ns').view('i8')
+in_range  = (spice_ing >= lo) & (spice_ing < hi)
+df_spice  = df_spice[in_range]
+spice_ing = spice_ing[in_range]
 
 
 tolerance = pd.Timedelta(seconds=60)   # Tolerated time offset since OBSWeb and SPICE occultations don't match exactly.
 
-merged = pd.merge_asof(
-    df_spice,
-    df_obsweb,
-    left_on='Ingress UTC',
-    right_on='ingress',
-    direction='nearest',
-    tolerance=tolerance,
-    suffixes=('_spice', '_obsw')
-)
+obsweb_ing = np.sort(df_obsweb['ingress'].values.astype('datetime64[ns]').view('i8'))
 
-# Drop any spice rows that found no obsweb match:
-merged = merged.dropna(subset=['ingress'])
+# Keep only spice rows with an obsweb ingress within the tolerance:
+matched = nearest_match_mask(spice_ing, obsweb_ing, tolerance.value)
 
-spice_covered = merged[
-    ['Ingress UTC',  'Ingress Lat (deg)', 'Ingress SZA (deg)',  'Egress UTC', 'Egress Lat (deg)', 'Egress SZA (deg)']
+spice_covered = df_spice.loc[matched,
+    ['Ingress UTC',  'Ingress Lat (deg)', 'Ingress SZA (deg)', 'Ingress Ls (deg)',
+     'Egress UTC',   'Egress Lat (deg)',  'Egress SZA (deg)',  'Egress Ls (deg)']
 ].copy()
 
 
@@ -77,162 +117,45 @@ print(f"Percent: {coverage_pct:.1f}%")
 
 # Latitude vs time:
 
-n_ingress = len(df_spice['Ingress UTC'])
-n_egress  = len(df_spice['Egress UTC'])
-label_ing = f'Ingress Points (N={n_ingress})'
-label_egr = f'Egress Points (N={n_egress})'
-
-plt.figure(figsize=(10, 6))
-plt.scatter(
-    df_spice['Ingress UTC'],
-    df_spice['Ingress Lat (deg)'],
-    facecolors='none',     # no fill
-    edgecolors='blue',     # circle outline color
-    s=10,                  # adjust marker size
-    linewidths=1,          # outline thickness
-    label=label_ing
-)
-plt.scatter(
-    df_spice['Egress UTC'],
-    df_spice['Egress Lat (deg)'],
-    facecolors='none',
-    edgecolors='red',
-    s=10,
-    linewidths=1,
-    label=label_egr
+plot_latitudes(
+    df_spice, 'Ingress UTC', 'Egress UTC', 'Date',
+    'Spatiotemporal Distribution of TGO–Earth Occultation Tangent-Point Latitudes',
+    xlim=(df_spice['Ingress UTC'].min(), df_spice['Ingress UTC'].max()),
+    legend_anchor=(0.81, 1),
+    date_axis=True,
 )
-plt.xlabel('Date', size=13)
-plt.ylabel('Mars latitude [deg]', size=13)
-plt.title('Spatiotemporal Distribution of TGO–Earth Occultation Tangent-Point Latitudes', size=15)
-plt.grid(color="gray", linestyle="dotted", linewidth=0.5)
-plt.legend(loc='upper right', bbox_to_anchor=(0.81, 1))
-plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))  # Set date formatter to show year-month-day
-plt.gca().xaxis.set_major_locator(mdates.MonthLocator(interval=2))  # interval=3 for 2020-2024, =2 for 2023-2024
-plt.gcf().autofmt_xdate()  # auto-rotate date labels
-plt.xlim(df_spice['Ingress UTC'].min(), df_spice['Ingress UTC'].max())
-plt.ylim(-90, 90)
-plt.tight_layout()
-plt.show()
-
-
-
-n_ingress = len(spice_covered['Ingress UTC'])
-n_egress  = len(spice_covered['Egress UTC'])
-label_ing = f'Ingress Points (N={n_ingress})'
-label_egr = f'Egress Points (N={n_egress})'
 
-plt.figure(figsize=(10, 6))
-plt.scatter(
-    spice_covered['Ingress UTC'],
-    spice_covered['Ingress Lat (deg)'],
-    facecolors='none',     # no fill
-    edgecolors='blue',     # circle outline color
-    s=10,                  # adjust marker size
-    linewidths=1,          # outline thickness
-    label=label_ing
-)
-plt.scatter(
-    spice_covered['Egress UTC'],
-    spice_covered['Egress Lat (deg)'],
-    facecolors='none',
-    edgecolors='red',
-    s=10,
-    linewidths=1,
-    label=label_egr
+plot_latitudes(
+    spice_covered, 'Ingress UTC', 'Egress UTC', 'Date',
+    'Spatiotemporal Distribution of TGO–Earth Occultations Tangent-Point Latitudes \n Covered by Ground Stations',
+    xlim=(spice_covered['Ingress UTC'].min(), spice_covered['Ingress UTC'].max()),
+    legend_anchor=(0.81, 1),
+    date_axis=True,
 )
-plt.xlabel('Date', size=13)
-plt.ylabel('Mars latitude [deg]', size=13)
-plt.title('Spatiotemporal Distribution of TGO–Earth Occultations Tangent-Point Latitudes \n Covered by Ground Stations',size=15)
-plt.grid(color="gray", linestyle="dotted", linewidth=0.5)
-plt.legend(loc='upper right', bbox_to_anchor=(0.81, 1))
-plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))  # Set date formatter to show year-month-day
-plt.gca().xaxis.set_major_locator(mdates.MonthLocator(interval=2))
-plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-plt.gcf().autofmt_xdate()  # auto-rotate date labels
-plt.xlim(spice_covered ['Ingress UTC'].min(), spice_covered ['Ingress UTC'].max())
-plt.ylim(-90, 90)
-plt.tight_layout()
-plt.show()
-
 
 
 # Latitude vs SZA:
 
-n_ingress = len(df_spice['Ingress SZA (deg)'])
-n_egress  = len(df_spice['Egress SZA (deg)'])
-label_ing = f'Ingress Points \n  (N={n_ingress})'
-label_egr = f'Egress Points \n  (N={n_egress})'
-
-plt.figure(figsize=(10, 6))
-plt.scatter(
-    df_spice['Ingress SZA (deg)'],
-    df_spice['Ingress Lat (deg)'],
-    facecolors='none',     # no fill
-    edgecolors='blue',     # circle outline color
-    s=10,                  # adjust marker size
-    linewidths=1,          # outline thickness
-    label=label_ing
-)
-plt.scatter(
-    df_spice['Egress SZA (deg)'],
-    df_spice['Egress Lat (deg)'],
-    facecolors='none',
-    edgecolors='red',
-    s=10,
-    linewidths=1,
-    label=label_egr
-)
-plt.xlabel('Solar Zenith Angle [deg]', size=13)
-plt.ylabel('Mars latitude [deg]', size=13)
-plt.title('Latitude vs Solar Zenith Angle at TGO–Earth Occultation Tangent Points', size=15)
-plt.grid(color="gray", linestyle="dotted", linewidth=0.5)
-plt.legend(loc='upper right', bbox_to_anchor=(1, 1))
-plt.xlim(
+sza_xlim = (
     min(df_spice['Ingress SZA (deg)'].min(), df_spice['Egress SZA (deg)'].min()),
     max(df_spice['Ingress SZA (deg)'].max(), df_spice['Egress SZA (deg)'].max())
 )
-plt.ylim(-90, 90)
-plt.tight_layout()
-plt.show()
-
 
-
-n_ingress = len(spice_covered['Ingress SZA (deg)'])
-n_egress  = len(spice_covered['Egress SZA (deg)'])
-label_ing = f'Ingress Points \n (N={n_ingress})'
-label_egr = f'Egress Points \n (N={n_egress})'
-
-plt.figure(figsize=(10, 6))
-plt.scatter(
-    spice_covered['Ingress SZA (deg)'],
-    spice_covered['Ingress Lat (deg)'],
-    facecolors='none',     # no fill
-    edgecolors='blue',     # circle outline color
-    s=10,                  # adjust marker size
-    linewidths=1,          # outline thickness
-    label=label_ing
-)
-plt.scatter(
-    spice_covered['Egress SZA (deg)'],
-    spice_covered['Egress Lat (deg)'],
-    facecolors='none',
-    edgecolors='red',
-    s=10,
-    linewidths=1,
-    label=label_egr
+plot_latitudes(
+    df_spice, 'Ingress SZA (deg)', 'Egress SZA (deg)', 'Solar Zenith Angle [deg]',
+    'Latitude vs Solar Zenith Angle at TGO–Earth Occultation Tangent Points',
+    xlim=sza_xlim,
+    legend_anchor=(1, 1),
+    label_sep=' \n ',
 )
-plt.xlabel('Solar Zenith Angle [deg]', size=13)
-plt.ylabel('Mars latitude [deg]', size=13)
-plt.title('Latitude vs Solar Zenith Angle at TGO–Earth Occultation Tangent Points \n Covered by Ground Stations', size=15)
-plt.grid(color="gray", linestyle="dotted", linewidth=0.5)
-plt.legend(loc='upper right', bbox_to_anchor=(1, 1))
-plt.xlim(
-    min(df_spice['Ingress SZA (deg)'].min(), df_spice['Egress SZA (deg)'].min()),
-    max(df_spice['Ingress SZA (deg)'].max(), df_spice['Egress SZA (deg)'].max())
+
+plot_latitudes(
+    spice_covered, 'Ingress SZA (deg)', 'Egress SZA (deg)', 'Solar Zenith Angle [deg]',
+    'Latitude vs Solar Zenith Angle at TGO–Earth Occultation Tangent Points \n Covered by Ground Stations',
+    xlim=sza_xlim,
+    legend_anchor=(1, 1),
+    label_sep=' \n ',
 )
-plt.ylim(-90, 90)
-plt.tight_layout()
-plt.show()
 
 
 